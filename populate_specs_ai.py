@@ -9,12 +9,22 @@ Requires: ANTHROPIC_API_KEY environment variable
 """
 
 import pandas as pd
+import asyncio
+import hashlib
 import json
 from typing import List, Dict, Optional
 import sys
 import os
-from bs4 import BeautifulSoup
 import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from populate_specs_v2 import (
+    EnhancedSpecExtractor,
+    TITLE_COL, BODY_COL, VENDOR_COL, TYPE_COL, MATERIAL_COL, SPEC_COL,
+    OUTPUT_FORMATS, has_value, column_values, json_dumps, json_loads, strip_html,
+    read_products, write_products
+)
 
 try:
     import anthropic
@@ -24,10 +34,174 @@ except ImportError:
     sys.exit(1)
 
 
+def is_valid_spec_list(specs) -> bool:
+    """Check that specs is a non-empty list of "Label: Value" strings"""
+    if not isinstance(specs, list) or len(specs) == 0:
+        return False
+    return all(isinstance(spec, str) and ':' in spec for spec in specs)
+
+
+class ExtractionCache:
+    """Disk-backed cache of extracted specs, one JSON file per prompt hash"""
+    
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return cached specs JSON, evicting entries that no longer validate"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = json_loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError):
+            entry = None
+        
+        specs = entry.get('specs') if isinstance(entry, dict) else None
+        if not is_valid_spec_list(specs):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        
+        return json_dumps(specs)
+    
+    def put(self, key: str, specs_json: str, model: str) -> None:
+        """Store validated specs JSON with model/timestamp metadata"""
+        entry = {
+            'model': model,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'specs': json_loads(specs_json)
+        }
+        # Write to a temp file first so an interrupted run never leaves a
+        # truncated entry behind
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json_dumps(entry))
+        os.replace(tmp_path, path)
+
+
+class TokenBucket:
+    """Async token-bucket rate limiter: allows bursts up to capacity, then
+    paces callers to rate_per_minute"""
+    
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self) -> None:
+        """Wait until a request may be sent"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Async semaphore whose limit follows the API's rate-limit headers"""
+    
+    # Fraction of the advertised request budget to actually use
+    SAFETY = 0.8
+    
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+    
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+    
+    async def set_limit(self, limit: int) -> None:
+        """Change the number of permits, clamped to [1, max_limit]"""
+        async with self._cond:
+            self.limit = max(1, min(self.max_limit, int(limit)))
+            self._cond.notify_all()
+    
+    async def update_from_headers(self, headers) -> None:
+        """Resize from anthropic-ratelimit-requests-remaining/-reset headers"""
+        remaining = headers.get('anthropic-ratelimit-requests-remaining')
+        reset = headers.get('anthropic-ratelimit-requests-reset')
+        if remaining is None or reset is None:
+            return
+        try:
+            reset_at = datetime.fromisoformat(reset.replace('Z', '+00:00'))
+            seconds_to_reset = (reset_at - datetime.now(timezone.utc)).total_seconds()
+            remaining = int(remaining)
+        except ValueError:
+            return
+        
+        await self.set_limit(remaining / max(seconds_to_reset, 1.0) * self.SAFETY)
+    
+    async def backoff(self) -> None:
+        """Halve concurrency after a rate-limit error"""
+        await self.set_limit(self.limit // 2)
+
+
 class AISpecExtractor:
     """Extract specifications using Claude API"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    # Bump when the system prompt changes to invalidate cached responses
+    PROMPT_VERSION = "v2"
+    
+    # Initial call plus retries with validation feedback
+    MAX_ATTEMPTS = 3
+    
+    # Retries after 429s (which also halve concurrency) or transient
+    # connection/server errors, with exponential backoff
+    MAX_REQUEST_RETRIES = 5
+    
+    # Six short "Label: Value" strings fit comfortably in this budget
+    MAX_TOKENS = 200
+    
+    # Structured output: Claude must return specs as this tool's input
+    SPECS_TOOL = {
+        "name": "emit_specs",
+        "description": "Emit product specs",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "specs": {
+                    "type": "array",
+                    "items": {"type": "string", "pattern": "^[^:]+: .+$"},
+                    "maxItems": 6
+                }
+            },
+            "required": ["specs"]
+        }
+    }
+    
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+        min_regex_specs: int = 3,
+        rate_per_minute: float = 50,
+        max_concurrency: int = 15
+    ):
         self.api_key = api_key or os.environ.get('ANTHROPIC_API_KEY')
         if not self.api_key:
             raise ValueError(
@@ -35,14 +209,30 @@ class AISpecExtractor:
                 "or pass api_key parameter"
             )
         
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        # SDK retries are off for real-time calls: they would bypass the
+        # token bucket and hide 429s from the adaptive concurrency limiter,
+        # so create_message does all retrying itself
+        self.client = anthropic.AsyncAnthropic(api_key=self.api_key, max_retries=0)
+        # Batch management calls are few and unpaced; keep the SDK's retries
+        self.batch_client = self.client.with_options(max_retries=2)
         self.model = "claude-3-5-haiku-20241022"  # Fast and cost-effective
+        self.cache = ExtractionCache(cache_dir) if cache_dir else None
+        self.api_calls = 0
+        self.cache_hits = 0
+        self.rate_limiter = TokenBucket(rate_per_minute) if rate_per_minute > 0 else None
+        self.concurrency = AdaptiveConcurrencyLimiter(max_concurrency)
+        
+        # Pattern-based extractor tried first; the API is only called when it
+        # finds fewer than min_regex_specs specs in the title/description
+        # text (0 always uses the API)
+        self._regex_extractor = EnhancedSpecExtractor()
+        self.min_regex_specs = min_regex_specs
         
         # System prompt for spec extraction
         self.system_prompt = """You are a product specification expert. Extract and format product specifications from product information.
 
 Rules:
-1. Output ONLY a JSON array of specifications
+1. Return the specifications by calling the emit_specs tool
 2. Each spec must be in format "Label: Value"
 3. Extract ONLY factual specifications that are explicitly stated or strongly implied
 4. Common spec types: Dimensions, Weight, Capacity, Material, Color, Power, Brand, Features
@@ -51,95 +241,341 @@ Rules:
 7. Do not make up specifications that aren't supported by the information
 8. If brand is in the title, always include it
 
-Example output format:
-["Brand: Salton", "Material: Stainless Steel", "Capacity: 12 cups", "Power: 1800 watts"]
-
-Return ONLY the JSON array, no other text."""
+Example specs:
+["Brand: Salton", "Material: Stainless Steel", "Capacity: 12 cups", "Power: 1800 watts"]"""
+        
+        # System prompt as a cacheable content block, so repeat calls are
+        # served from Anthropic's prompt cache instead of re-billed in full
+        self.system_blocks = [
+            {
+                "type": "text",
+                "text": self.system_prompt,
+                "cache_control": {"type": "ephemeral"}
+            }
+        ]
+        
+        self.tools = [self.SPECS_TOOL]
+        self.tool_choice = {"type": "tool", "name": self.SPECS_TOOL["name"]}
+        
+        # Prompt cache usage, to confirm cache hits
+        self.cache_stats = {
+            'cache_creation_input_tokens': 0,
+            'cache_read_input_tokens': 0
+        }
     
     def clean_html(self, html_text: str) -> str:
         """Remove HTML tags"""
-        if pd.isna(html_text):
+        if not has_value(html_text):
             return ""
-        soup = BeautifulSoup(str(html_text), 'html.parser')
-        return soup.get_text(separator=' ', strip=True)
+        return strip_html(str(html_text))
     
     def build_product_context(self, row: pd.Series) -> str:
         """Build context string from product data"""
+        return self.build_context_from_fields(
+            row.get(TITLE_COL),
+            row.get(BODY_COL),
+            row.get(TYPE_COL),
+            row.get(VENDOR_COL),
+            row.get(MATERIAL_COL)
+        )
+    
+    def build_context_from_fields(self, title, body_html, product_type, vendor, material) -> str:
+        """Build context string from one product's raw cell values"""
         context_parts = []
         
-        if pd.notna(row.get('Title')):
-            context_parts.append(f"Product: {row['Title']}")
+        if has_value(title):
+            context_parts.append(f"Product: {title}")
         
-        if pd.notna(row.get('Body HTML')):
-            description = self.clean_html(row['Body HTML'])
+        if has_value(body_html):
+            description = self.clean_html(body_html)
             context_parts.append(f"Description: {description}")
         
-        if pd.notna(row.get('Type')):
-            context_parts.append(f"Category: {row['Type']}")
+        if has_value(product_type):
+            context_parts.append(f"Category: {product_type}")
         
-        if pd.notna(row.get('Vendor')):
-            context_parts.append(f"Vendor: {row['Vendor']}")
+        if has_value(vendor):
+            context_parts.append(f"Vendor: {vendor}")
         
-        if pd.notna(row.get('Metafield: custom.product_material [single_line_text_field]')):
-            material = row['Metafield: custom.product_material [single_line_text_field]']
+        if has_value(material):
             context_parts.append(f"Material: {material}")
         
         return "\n".join(context_parts)
     
-    def extract_specs_with_ai(self, product_context: str) -> Optional[str]:
+    def cache_key(self, product_context: str) -> str:
+        """Content hash identifying a model/prompt/product combination"""
+        raw = f"{self.model}|{self.PROMPT_VERSION}|{product_context}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def get_cached(self, product_context: str) -> Optional[str]:
+        """Look up a previous result for this product context (a failed read
+        is treated as a miss)"""
+        if self.cache is None:
+            return None
+        try:
+            specs_json = self.cache.get(self.cache_key(product_context))
+        except Exception as e:
+            print(f"Warning: Cache read failed: {e}")
+            return None
+        if specs_json:
+            self.cache_hits += 1
+        return specs_json
+    
+    def put_cached(self, product_context: str, specs_json: Optional[str]) -> None:
+        """Store a successful result for this product context (a failed write
+        is skipped so the paid-for result is still used)"""
+        if self.cache is None or not specs_json:
+            return
+        try:
+            self.cache.put(self.cache_key(product_context), specs_json, self.model)
+        except Exception as e:
+            print(f"Warning: Cache write failed: {e}")
+    
+    async def extract_specs_with_ai(self, product_context: str) -> Optional[str]:
         """Use Claude to extract specifications"""
+        cached = self.get_cached(product_context)
+        if cached:
+            return cached
+        
+        messages = [
+            {
+                "role": "user",
+                "content": product_context
+            }
+        ]
+        
         try:
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=300,
-                system=self.system_prompt,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": product_context
-                    }
-                ]
-            )
-            
-            # Extract the JSON array from response
-            response_text = message.content[0].text.strip()
-            
-            # Parse and validate JSON
-            specs = json.loads(response_text)
-            
-            if isinstance(specs, list) and len(specs) > 0:
-                # Validate format
-                for spec in specs:
-                    if not isinstance(spec, str) or ':' not in spec:
+            for attempt in range(self.MAX_ATTEMPTS):
+                message = await self.create_message(messages)
+                
+                # Extract the specs from the tool call
+                try:
+                    specs_json = self.validate_specs_message(message)
+                except ValueError as e:
+                    if attempt == self.MAX_ATTEMPTS - 1:
+                        print(f"Warning: Invalid response from API after "
+                              f"{self.MAX_ATTEMPTS} attempts: {e}")
                         return None
-                return json.dumps(specs)
+                    
+                    # Show the model its mistake and let it correct itself
+                    tool_use = self.find_tool_use(message)
+                    if tool_use is None:
+                        feedback = {
+                            "role": "user",
+                            "content": f"Your output had error: {e}. Call the "
+                                       f"{self.SPECS_TOOL['name']} tool with 'Label: Value' strings."
+                        }
+                    else:
+                        feedback = {
+                            "role": "user",
+                            "content": [
+                                {
+                                    "type": "tool_result",
+                                    "tool_use_id": tool_use.id,
+                                    "content": f"Your output had error: {e}. Return "
+                                               f"only 'Label: Value' strings.",
+                                    "is_error": True
+                                }
+                            ]
+                        }
+                    messages = messages + [
+                        {"role": "assistant", "content": message.content},
+                        feedback
+                    ]
+                    await asyncio.sleep(1.0 * (attempt + 1))
+                    continue
+                
+                self.put_cached(product_context, specs_json)
+                return specs_json
             
+        except Exception as e:
+            print(f"Warning: API error: {e}")
             return None
+    
+    async def create_message(self, messages: List[Dict]):
+        """Send one request, pacing it and adapting concurrency to rate limits"""
+        for retry in range(self.MAX_REQUEST_RETRIES + 1):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            
+            try:
+                async with self.concurrency:
+                    self.api_calls += 1
+                    raw = await self.client.messages.with_raw_response.create(
+                        model=self.model,
+                        max_tokens=self.MAX_TOKENS,
+                        system=self.system_blocks,
+                        tools=self.tools,
+                        tool_choice=self.tool_choice,
+                        messages=messages
+                    )
+            except (
+                anthropic.RateLimitError,
+                anthropic.APIConnectionError,
+                anthropic.InternalServerError
+            ) as e:
+                if retry == self.MAX_REQUEST_RETRIES:
+                    raise
+                if isinstance(e, anthropic.RateLimitError):
+                    await self.concurrency.backoff()
+                await asyncio.sleep(2.0 ** retry)
+                continue
             
-        except json.JSONDecodeError:
-            print(f"Warning: Invalid JSON response from API")
+            await self.concurrency.update_from_headers(raw.headers)
+            message = await raw.parse()
+            self.record_cache_usage(message.usage)
+            return message
+    
+    def record_cache_usage(self, usage) -> None:
+        """Accumulate prompt cache token counts from a response's usage"""
+        for key in self.cache_stats:
+            self.cache_stats[key] += getattr(usage, key, None) or 0
+    
+    def find_tool_use(self, message):
+        """Return the emit_specs tool call in a response, if any"""
+        for block in message.content:
+            if block.type == "tool_use" and block.name == self.SPECS_TOOL["name"]:
+                return block
+        return None
+    
+    def validate_specs_message(self, message) -> str:
+        """Validate specs emitted by Claude's tool call, raising ValueError if invalid"""
+        tool_use = self.find_tool_use(message)
+        if tool_use is None:
+            raise ValueError(f"no {self.SPECS_TOOL['name']} tool call in response")
+        
+        specs = tool_use.input.get("specs") if isinstance(tool_use.input, dict) else None
+        if not is_valid_spec_list(specs):
+            raise ValueError("expected a non-empty list of 'Label: Value' strings")
+        
+        return json_dumps(specs)
+    
+    def parse_specs_message(self, message) -> Optional[str]:
+        """Validate specs emitted by Claude's tool call, warning on failure"""
+        try:
+            return self.validate_specs_message(message)
+        except ValueError as e:
+            print(f"Warning: Invalid response from API: {e}")
             return None
-        except Exception as e:
-            print(f"Warning: API error: {e}")
+    
+    def build_batch_request(self, custom_id: str, product_context: str) -> Dict:
+        """Build a Message Batches API request for one product"""
+        return {
+            "custom_id": custom_id,
+            "params": {
+                "model": self.model,
+                "max_tokens": self.MAX_TOKENS,
+                "system": self.system_blocks,
+                "tools": self.tools,
+                "tool_choice": self.tool_choice,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": product_context
+                    }
+                ]
+            }
+        }
+    
+    async def extract_specs_batch(
+        self,
+        product_contexts: Dict[str, str],
+        poll_interval: float = 10.0,
+        verbose: bool = True
+    ) -> Dict[str, Optional[str]]:
+        """
+        Extract specifications for many products via the Message Batches API
+        
+        Args:
+            product_contexts: Mapping of custom_id to product context
+            poll_interval: Seconds to wait between batch status checks
+            verbose: If True, print batch progress
+        
+        Returns:
+            Mapping of custom_id to specs JSON (None on failure)
+        """
+        results = {}
+        requests = []
+        for custom_id, context in product_contexts.items():
+            results[custom_id] = self.get_cached(context)
+            if not results[custom_id]:
+                requests.append(self.build_batch_request(custom_id, context))
+        if not requests:
+            return results
+        self.api_calls += len(requests)
+        
+        batch = await self.batch_client.messages.batches.create(requests=requests)
+        if verbose:
+            print(f"Submitted batch {batch.id} with {len(requests)} requests")
+        
+        # Poll until the batch has finished processing
+        while batch.processing_status != "ended":
+            await asyncio.sleep(poll_interval)
+            batch = await self.batch_client.messages.batches.retrieve(batch.id)
+            if verbose:
+                counts = batch.request_counts
+                print(f"Batch {batch.id}: {counts.processing} processing, "
+                      f"{counts.succeeded} succeeded, {counts.errored} errored")
+        
+        # Stream results back
+        async for entry in await self.batch_client.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                self.record_cache_usage(entry.result.message.usage)
+                specs_json = self.parse_specs_message(entry.result.message)
+                self.put_cached(product_contexts[entry.custom_id], specs_json)
+                results[entry.custom_id] = specs_json
+            else:
+                print(f"Warning: Batch request {entry.custom_id} {entry.result.type}")
+        
+        return results
+    
+    def extract_specs_with_regex(self, title, body_html, vendor, product_type, material) -> Optional[str]:
+        """Return pattern-extracted specs if there are enough to skip the API"""
+        if self.min_regex_specs <= 0:
             return None
+        
+        # Brand/Category/Material copied from columns don't count: they say
+        # nothing about whether the description was understood
+        specs, text_count = self._regex_extractor.collect_specs(
+            title, body_html, vendor, product_type, material
+        )
+        if text_count >= self.min_regex_specs:
+            return self._regex_extractor.format_specs_for_shopify(specs)
+        return None
     
-    def process_row(self, row: pd.Series) -> str:
-        """Process a single row with AI"""
-        product_context = self.build_product_context(row)
+    async def process_row(self, row: pd.Series) -> str:
+        """Process a single row, using AI only when pattern matching falls short"""
+        regex_json = self.extract_specs_with_regex(
+            row.get(TITLE_COL),
+            row.get(BODY_COL),
+            row.get(VENDOR_COL),
+            row.get(TYPE_COL),
+            row.get(MATERIAL_COL)
+        )
+        if regex_json:
+            return regex_json
         
+        return await self.process_context(self.build_product_context(row))
+    
+    async def process_context(self, product_context: str) -> str:
+        """Process a prebuilt product context with AI"""
         if not product_context.strip():
             return ""
         
-        return self.extract_specs_with_ai(product_context) or ""
+        return await self.extract_specs_with_ai(product_context) or ""
 
 
-def process_excel_file(
+async def process_excel_file(
     input_file: str,
     output_file: str = None,
     api_key: Optional[str] = None,
     overwrite_existing: bool = False,
     verbose: bool = True,
-    batch_delay: float = 0.5
+    max_concurrency: int = 15,
+    use_batch: bool = False,
+    cache_dir: Optional[str] = None,
+    fmt: Optional[str] = None,
+    min_regex_specs: int = 3,
+    rate_per_minute: float = 50
 ):
     """
     Process Excel file using AI
@@ -150,28 +586,50 @@ def process_excel_file(
         api_key: Anthropic API key (or use ANTHROPIC_API_KEY env var)
         overwrite_existing: If True, overwrite existing specs
         verbose: If True, print detailed progress
-        batch_delay: Delay between API calls (seconds) to avoid rate limits
+        max_concurrency: Maximum number of API calls in flight at once; lowered
+            automatically when rate-limit headers show little headroom
+        use_batch: If True, submit all rows through the Message Batches API
+            (half the cost, results arrive asynchronously)
+        cache_dir: Directory for cached API responses; unchanged products
+            are not sent to the API again on later runs
+        fmt: Output format ('xlsx', 'csv' or 'parquet'; defaults to the
+            output file's extension)
+        min_regex_specs: Skip the API for products where pattern matching
+            already finds at least this many specs in the title/description
+            (column copies like Brand and Category don't count; 0 always
+            uses the API)
+        rate_per_minute: Real-time API request limit, enforced with a token
+            bucket (0 disables rate limiting)
     """
     
     if verbose:
         print(f"Reading Excel file: {input_file}")
     
-    df = pd.read_excel(input_file, sheet_name=0)
+    df = read_products(input_file)
+    
+    # Batch requests are billed at half the real-time rate
+    cost_per_call = 0.00015 if use_batch else 0.0003
     
     if verbose:
         print(f"Found {len(df)} products")
         print(f"Using AI model: claude-3-5-haiku-20241022")
-        print(f"Estimated cost: ${len(df) * 0.0003:.2f} (approximate)\n")
+        print(f"Estimated cost: ${len(df) * cost_per_call:.2f} (approximate)\n")
     
     # Initialize AI extractor
     try:
-        extractor = AISpecExtractor(api_key=api_key)
+        extractor = AISpecExtractor(
+            api_key=api_key,
+            cache_dir=cache_dir,
+            min_regex_specs=min_regex_specs,
+            rate_per_minute=rate_per_minute,
+            max_concurrency=max_concurrency
+        )
     except ValueError as e:
         print(f"Error: {e}")
         sys.exit(1)
     
     # Column name
-    spec_col = 'Metafield: custom.spec_list [list.single_line_text_field]'
+    spec_col = SPEC_COL
     
     # Track statistics
     stats = {
@@ -179,65 +637,129 @@ def process_excel_file(
         'already_populated': 0,
         'newly_populated': 0,
         'failed': 0,
+        'regex_populated': 0,
+        'duplicates': 0,
         'specs_extracted': 0,
-        'api_calls': 0
+        'api_calls': 0,
+        'cache_hits': 0
     }
     
+    # Pull the source columns out once instead of boxing every row
+    titles = column_values(df, TITLE_COL)
+    bodies = column_values(df, BODY_COL)
+    types = column_values(df, TYPE_COL)
+    vendors = column_values(df, VENDOR_COL)
+    materials = column_values(df, MATERIAL_COL)
+    spec_values = column_values(df, spec_col)
+    
     # Process each row
     if verbose:
         print("Processing products with AI...")
         print("="*70)
     
-    for idx, row in df.iterrows():
+    # Collect rows that need specs; rows pattern matching covers are resolved here
+    pending = []
+    resolved = []
+    for i in range(len(df)):
         # Check if already has specs
-        has_existing = pd.notna(row[spec_col]) and str(row[spec_col]).strip()
+        existing = spec_values[i]
+        has_existing = has_value(existing) and str(existing).strip()
         
         if has_existing and not overwrite_existing:
             stats['already_populated'] += 1
             continue
         
-        # Extract with AI
-        specs_json = extractor.process_row(row)
-        stats['api_calls'] += 1
+        regex_json = extractor.extract_specs_with_regex(
+            titles[i], bodies[i], vendors[i], types[i], materials[i]
+        )
+        if regex_json:
+            resolved.append((i, regex_json))
+            stats['regex_populated'] += 1
+            continue
+        
+        context = extractor.build_context_from_fields(
+            titles[i], bodies[i], types[i], vendors[i], materials[i]
+        )
+        pending.append((i, context))
+    
+    # Variants often share a description; call the API once per unique context
+    groups = defaultdict(list)
+    for i, context in pending:
+        groups[context].append(i)
+    unique_contexts = list(groups)
+    stats['duplicates'] = len(pending) - len(unique_contexts)
+    
+    if use_batch:
+        # Submit everything as a single batch and wait for it to finish,
+        # using each context's first row as its custom_id
+        contexts = {
+            str(groups[context][0]): context
+            for context in unique_contexts if context.strip()
+        }
+        batch_results = await extractor.extract_specs_batch(contexts, verbose=verbose)
+        results = [batch_results.get(str(groups[context][0])) or "" for context in unique_contexts]
+    else:
+        # Dispatch API calls concurrently; the extractor's limiter bounds how
+        # many are in flight
+        completed = 0
+        
+        async def run_one(context: str) -> str:
+            nonlocal completed
+            result = await extractor.process_context(context)
+            completed += 1
+            if verbose and completed % 10 == 0:
+                print(f"\nProcessed {completed}/{len(unique_contexts)} products...")
+            return result
+        
+        tasks = [run_one(context) for context in unique_contexts]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    
+    stats['api_calls'] = extractor.api_calls
+    stats['cache_hits'] = extractor.cache_hits
+    
+    # Fan each unique result back out to every row that shares the context
+    context_results = dict(zip(unique_contexts, results))
+    resolved.extend((i, context_results[context]) for i, context in pending)
+    resolved.sort(key=lambda item: item[0])
+    
+    for i, specs_json in resolved:
+        if isinstance(specs_json, Exception):
+            print(f"Warning: API error: {specs_json}")
+            specs_json = None
         
         if specs_json:
-            df.at[idx, spec_col] = specs_json
+            spec_values[i] = specs_json
             stats['newly_populated'] += 1
             
             # Count specs
             try:
-                specs_list = json.loads(specs_json)
+                specs_list = json_loads(specs_json)
                 stats['specs_extracted'] += len(specs_list)
                 
                 # Print samples
                 if verbose and stats['newly_populated'] <= 3:
-                    print(f"\n✓ {row.get('Title', 'Unknown')}")
+                    print(f"\n✓ {titles[i] if has_value(titles[i]) else 'Unknown'}")
                     for spec in specs_list:
                         print(f"  • {spec}")
             except:
                 pass
         else:
             stats['failed'] += 1
-        
-        # Progress indicator
-        if verbose and (idx + 1) % 10 == 0:
-            print(f"\nProcessed {idx + 1}/{len(df)} products...")
-        
-        # Rate limiting
-        if batch_delay > 0:
-            time.sleep(batch_delay)
+    
+    # Write the spec column back in one assignment
+    df[spec_col] = spec_values
     
     # Determine output file
     if output_file is None:
         base_name = os.path.splitext(input_file)[0]
-        output_file = f"{base_name}_with_ai_specs.xlsx"
+        output_file = f"{base_name}_with_ai_specs.{fmt or 'xlsx'}"
     
     # Save
     if verbose:
         print(f"\n{'='*70}")
         print(f"Saving to: {output_file}")
     
-    df.to_excel(output_file, index=False, engine='openpyxl')
+    write_products(df, output_file, fmt)
     
     # Summary
     if verbose:
@@ -248,11 +770,17 @@ def process_excel_file(
         print(f"Already had specs: {stats['already_populated']}")
         print(f"Newly populated: {stats['newly_populated']}")
         print(f"Failed: {stats['failed']}")
+        print(f"Populated without API: {stats['regex_populated']}")
+        print(f"Duplicate descriptions reused: {stats['duplicates']}")
         print(f"Total specs extracted: {stats['specs_extracted']}")
         if stats['newly_populated'] > 0:
             print(f"Average specs per product: {stats['specs_extracted']/stats['newly_populated']:.1f}")
         print(f"API calls made: {stats['api_calls']}")
-        print(f"Estimated cost: ${stats['api_calls'] * 0.0003:.2f}")
+        if cache_dir:
+            print(f"Cache hits: {stats['cache_hits']}")
+        print(f"Prompt cache tokens: {extractor.cache_stats['cache_read_input_tokens']} read, "
+              f"{extractor.cache_stats['cache_creation_input_tokens']} written")
+        print(f"Estimated cost: ${stats['api_calls'] * cost_per_call:.2f}")
         print(f"\nOutput saved to: {output_file}")
         print("="*70)
     
@@ -273,7 +801,11 @@ Examples:
   export ANTHROPIC_API_KEY="sk-ant-..."
   python populate_specs_ai.py test-list.xlsx
   python populate_specs_ai.py test-list.xlsx -o output.xlsx
-  python populate_specs_ai.py test-list.xlsx --overwrite --delay 1.0
+  python populate_specs_ai.py test-list.xlsx --overwrite --concurrency 5 --rate-limit 20
+  python populate_specs_ai.py test-list.xlsx --batch
+  python populate_specs_ai.py test-list.xlsx --cache-dir .spec_cache
+  python populate_specs_ai.py test-list.xlsx --format csv
+  python populate_specs_ai.py test-list.xlsx --min-regex-specs 0
         """
     )
     
@@ -284,20 +816,36 @@ Examples:
                        help='Overwrite existing specifications')
     parser.add_argument('-q', '--quiet', action='store_true',
                        help='Suppress progress output')
-    parser.add_argument('--delay', type=float, default=0.5,
-                       help='Delay between API calls (seconds, default: 0.5)')
+    parser.add_argument('--concurrency', type=int, default=15,
+                       help='Maximum concurrent API calls (default: 15)')
+    parser.add_argument('--batch', action='store_true',
+                       help='Use the Message Batches API (50%% cheaper, slower turnaround)')
+    parser.add_argument('--cache-dir',
+                       help='Directory to cache API responses between runs (optional)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS,
+                       help='Output format (default: from output extension, else xlsx)')
+    parser.add_argument('--min-regex-specs', type=int, default=3,
+                       help='Skip the API when pattern matching finds this many specs '
+                            'in the title/description (default: 3, 0 always uses the API)')
+    parser.add_argument('--rate-limit', type=float, default=50,
+                       help='Maximum API requests per minute (default: 50, 0 for no limit)')
     
     args = parser.parse_args()
     
     try:
-        process_excel_file(
+        asyncio.run(process_excel_file(
             args.input_file,
             args.output,
             api_key=args.api_key,
             overwrite_existing=args.overwrite,
             verbose=not args.quiet,
-            batch_delay=args.delay
-        )
+            max_concurrency=args.concurrency,
+            use_batch=args.batch,
+            cache_dir=args.cache_dir,
+            fmt=args.format,
+            min_regex_specs=args.min_regex_specs,
+            rate_per_minute=args.rate_limit
+        ))
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         import traceback
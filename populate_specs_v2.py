@@ -11,10 +11,178 @@ Version 2.0 - Enhanced extraction with better validation
 import pandas as pd
 import re
 import json
-from bs4 import BeautifulSoup
+import html
+import functools
 from typing import List, Dict, Optional, Tuple
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor
+import openpyxl
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Source columns read from the Matrixify export
+TITLE_COL = 'Title'
+BODY_COL = 'Body HTML'
+VENDOR_COL = 'Vendor'
+TYPE_COL = 'Type'
+MATERIAL_COL = 'Metafield: custom.product_material [single_line_text_field]'
+SPEC_COL = 'Metafield: custom.spec_list [list.single_line_text_field]'
+
+# Supported output file formats
+OUTPUT_FORMATS = ('xlsx', 'csv', 'parquet')
+
+# Feature-list patterns, compiled once at import time
+BULLET_PATTERN = re.compile(r'[•●○▪▫]\s*([^•●○▪▫\n]{10,80})')
+FEATURE_KEYWORD_PATTERNS = [
+    (re.compile(r'featuring:?\s+([^.]{15,80})\.', re.IGNORECASE), 'Feature'),
+    (re.compile(r'includes:?\s+([^.]{15,80})\.', re.IGNORECASE), 'Included'),
+    (re.compile(r'comes with:?\s+([^.]{15,80})\.', re.IGNORECASE), 'Included'),
+]
+MATERIAL_FILLER_PATTERN = re.compile(r'\b(with|and|for|the|a|an)\b.*')
+
+# HTML stripping patterns (script/style bodies and comments are not text)
+HTML_SKIP_PATTERN = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->', re.IGNORECASE | re.DOTALL)
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def has_value(value) -> bool:
+    """Fast notna check for a single cell (NaN is the only value != itself)"""
+    return value is not None and value == value
+
+
+def json_dumps(obj) -> str:
+    """Encode JSON with orjson when available; the stdlib fallback matches its
+    compact, non-ASCII-escaped output so results don't depend on the install"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def json_loads(data):
+    """Decode JSON with orjson when available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@functools.lru_cache(maxsize=4096)
+def strip_html(html_text: str) -> str:
+    """Strip tags, decode entities and collapse whitespace (cached, since
+    variants repeat the same description)"""
+    text = HTML_SKIP_PATTERN.sub(' ', html_text)
+    text = html.unescape(HTML_TAG_PATTERN.sub(' ', text))
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def column_values(df: pd.DataFrame, column: str) -> list:
+    """Return a column as a plain list, or all None if the column is missing"""
+    if column in df.columns:
+        return df[column].tolist()
+    return [None] * len(df)
+
+
+def dedupe_column_names(names: list) -> list:
+    """Rename repeated headers the way pd.read_excel does (Title, Title.1, ...)"""
+    names = list(names)
+    counts = {}
+    for i, name in enumerate(names):
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        names[i] = name
+        counts[name] = count + 1
+    return names
+
+
+def read_products(input_file: str) -> pd.DataFrame:
+    """Stream the first sheet of an Excel file into a DataFrame"""
+    wb = openpyxl.load_workbook(input_file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        columns = dedupe_column_names([
+            name if name is not None else f"Unnamed: {i}"
+            for i, name in enumerate(header)
+        ])
+        records = list(rows)
+        # Read-only sheets can report trailing blank rows; trim only those,
+        # blank rows inside the data are kept like pd.read_excel does
+        while records and all(cell is None for cell in records[-1]):
+            records.pop()
+    finally:
+        # Read-only workbooks hold the file open until closed
+        wb.close()
+    
+    return pd.DataFrame(records, columns=columns)
+
+
+def output_format(output_file: str, fmt: Optional[str] = None) -> str:
+    """Resolve the output format, defaulting to the output file's extension"""
+    if fmt:
+        return fmt
+    ext = os.path.splitext(output_file)[1].lower().lstrip('.')
+    return ext if ext in OUTPUT_FORMATS else 'xlsx'
+
+
+def stringify_mixed_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Return a copy pyarrow can store: string column names, and mixed-type
+    object columns (e.g. SKUs that are partly numbers) cast to str with
+    nulls kept"""
+    df = df.copy()
+    df.columns = [str(col) for col in df.columns]
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        if column.dtype != object:
+            continue
+        types = {type(v) for v in column if has_value(v)}
+        if len(types) > 1:
+            df.iloc[:, i] = column.map(lambda v: str(v) if has_value(v) else None)
+    return df
+
+
+def write_products(df: pd.DataFrame, output_file: str, fmt: Optional[str] = None) -> None:
+    """Write a DataFrame as xlsx, csv or parquet"""
+    fmt = output_format(output_file, fmt)
+    if fmt == 'parquet':
+        stringify_mixed_columns(df).to_parquet(output_file, engine='pyarrow', compression='zstd', index=False)
+        return
+    if fmt == 'csv':
+        df.to_csv(output_file, index=False)
+        return
+    
+    # Excel: stream rows to disk when xlsxwriter is available
+    if xlsxwriter is None:
+        df.to_excel(output_file, index=False, engine='openpyxl')
+        return
+    
+    # constant_memory flushes each row as soon as the next one starts, so
+    # rows must be written strictly in order (pandas writes column by column)
+    wb = xlsxwriter.Workbook(output_file, {
+        'constant_memory': True,
+        'strings_to_urls': False,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss'
+    })
+    try:
+        ws = wb.add_worksheet()
+        ws.write_row(0, 0, [str(col) for col in df.columns])
+        for r, row in enumerate(df.astype(object).itertuples(index=False, name=None), start=1):
+            ws.write_row(r, 0, [cell if has_value(cell) else None for cell in row])
+    finally:
+        wb.close()
+
 
 class EnhancedSpecExtractor:
     """Extract specifications with improved validation and cleaning"""
@@ -24,12 +192,12 @@ class EnhancedSpecExtractor:
         self.api_key = api_key
         
         # Improved patterns with better validation
-        self.patterns = {
+        raw_patterns = {
             'Dimensions': [
                 (r'(\d+\.?\d*)\s*["\']?\s*[xX×]\s*(\d+\.?\d*)\s*["\']?\s*[xX×]\s*(\d+\.?\d*)\s*["\']?\s*(inches?|in|cm|mm|")?', 
-                 lambda m: self._format_dimensions(m)),
+                 self._format_dimensions_3),
                 (r'(?:dimensions?|size):?\s*(\d+\.?\d*)\s*[xX×]\s*(\d+\.?\d*)\s*(?:[xX×]\s*(\d+\.?\d*))?',
-                 lambda m: self._format_dimensions(m)),
+                 self._format_dimensions_labeled),
             ],
             'Weight': [
                 (r'(\d+\.?\d*)\s*(lbs?|pounds?|kg|kilograms?)\b',
@@ -72,24 +240,31 @@ class EnhancedSpecExtractor:
                  lambda m: f"{m.group(1)} pieces"),
             ],
         }
+        
+        # Compile once so per-row searches skip the re module's pattern cache
+        self.patterns = {
+            name: [(re.compile(pattern, re.IGNORECASE), formatter) for pattern, formatter in patterns]
+            for name, patterns in raw_patterns.items()
+        }
     
-    def _format_dimensions(self, match) -> str:
-        """Format dimension matches consistently"""
-        groups = [g for g in match.groups() if g and g.replace('.', '').isdigit()]
-        if len(groups) >= 3:
-            unit = match.group(4) if len(match.groups()) >= 4 and match.group(4) else "inches"
-            if unit == '"':
-                unit = "inches"
-            return f"{groups[0]} x {groups[1]} x {groups[2]} {unit}"
-        elif len(groups) == 2:
-            return f"{groups[0]} x {groups[1]}"
-        return ""
+    def _format_dimensions_3(self, match) -> str:
+        """Format "A x B x C [unit]" matches consistently"""
+        unit = match.group(4) or "inches"
+        if unit == '"':
+            unit = "inches"
+        return f"{match.group(1)} x {match.group(2)} x {match.group(3)} {unit}"
+    
+    def _format_dimensions_labeled(self, match) -> str:
+        """Format "Dimensions: A x B [x C]" matches consistently"""
+        if match.group(3):
+            return f"{match.group(1)} x {match.group(2)} x {match.group(3)} inches"
+        return f"{match.group(1)} x {match.group(2)}"
     
     def _clean_material(self, material: str) -> str:
         """Clean and format material string"""
         material = material.strip().lower()
         # Remove common filler words
-        material = re.sub(r'\b(with|and|for|the|a|an)\b.*', '', material).strip()
+        material = MATERIAL_FILLER_PATTERN.sub('', material).strip()
         if 3 < len(material) < 30:
             return material.title()
         return ""
@@ -117,11 +292,9 @@ class EnhancedSpecExtractor:
     
     def clean_html(self, html_text: str) -> str:
         """Remove HTML tags and clean text"""
-        if pd.isna(html_text):
+        if not has_value(html_text):
             return ""
-        soup = BeautifulSoup(str(html_text), 'html.parser')
-        text = soup.get_text(separator=' ', strip=True)
-        return ' '.join(text.split())
+        return strip_html(str(html_text))
     
     def extract_specs_from_text(self, text: str, max_specs: int = 6) -> Dict[str, str]:
         """Extract specifications with improved validation"""
@@ -133,7 +306,7 @@ class EnhancedSpecExtractor:
                 break
                 
             for pattern, formatter in patterns:
-                matches = re.search(pattern, text_lower, re.IGNORECASE)
+                matches = pattern.search(text_lower)
                 if matches:
                     try:
                         value = formatter(matches)
@@ -150,8 +323,7 @@ class EnhancedSpecExtractor:
         features = []
         
         # Look for feature lists (with bullets or numbered)
-        bullet_pattern = r'[•●○▪▫]\s*([^•●○▪▫\n]{10,80})'
-        bullets = re.findall(bullet_pattern, text)
+        bullets = BULLET_PATTERN.findall(text)
         for bullet in bullets[:max_features]:
             feature = bullet.strip().rstrip('.,')
             if 10 < len(feature) < 80 and self._is_valid_value(feature):
@@ -161,14 +333,8 @@ class EnhancedSpecExtractor:
             return features
         
         # Look for 'featuring' or 'includes' phrases
-        feature_keywords = [
-            (r'featuring:?\s+([^.]{15,80})\.', 'Feature'),
-            (r'includes:?\s+([^.]{15,80})\.', 'Included'),
-            (r'comes with:?\s+([^.]{15,80})\.', 'Included'),
-        ]
-        
-        for pattern, label in feature_keywords:
-            matches = re.findall(pattern, text, re.IGNORECASE)
+        for pattern, label in FEATURE_KEYWORD_PATTERNS:
+            matches = pattern.findall(text)
             for match in matches[:max_features - len(features)]:
                 feature = match.strip().rstrip(',')
                 if 15 < len(feature) < 80 and self._is_valid_value(feature):
@@ -179,13 +345,13 @@ class EnhancedSpecExtractor:
     def extract_brand(self, title: str, vendor: str = None) -> Optional[str]:
         """Extract brand with better validation"""
         # Prefer vendor field if available
-        if pd.notna(vendor):
+        if has_value(vendor):
             brand = str(vendor).strip()
             if 2 < len(brand) < 30:
                 return brand
         
         # Extract from title
-        if pd.notna(title):
+        if has_value(title):
             words = str(title).split()
             if words:
                 brand = words[0]
@@ -196,47 +362,66 @@ class EnhancedSpecExtractor:
     
     def process_row(self, row: pd.Series) -> str:
         """Process a single row with enhanced extraction"""
+        return self.process_fields(
+            row.get(TITLE_COL),
+            row.get(BODY_COL),
+            row.get(VENDOR_COL),
+            row.get(TYPE_COL),
+            row.get(MATERIAL_COL)
+        )
+    
+    def process_fields(self, title, body_html, vendor, product_type, material) -> str:
+        """Process one product's raw cell values with enhanced extraction"""
+        all_specs, _ = self.collect_specs(title, body_html, vendor, product_type, material)
+        return self.format_specs_for_shopify(all_specs)
+    
+    def collect_specs(self, title, body_html, vendor, product_type, material) -> Tuple[Dict[str, str], int]:
+        """Collect specs for one product, plus how many came from the title or
+        description text rather than being copied from Vendor/Type/material columns"""
         all_specs = {}
+        column_keys = set()
+        clean_text = self.clean_html(body_html)
         
         # 1. Extract structured specs from description
-        if pd.notna(row.get('Body HTML')):
-            clean_text = self.clean_html(row['Body HTML'])
+        if clean_text:
             text_specs = self.extract_specs_from_text(clean_text, max_specs=5)
             all_specs.update(text_specs)
         
         # 2. Extract from title (for dimensions, capacity, etc.)
-        if pd.notna(row.get('Title')):
-            clean_title = self.clean_html(row['Title'])
+        if has_value(title):
+            clean_title = self.clean_html(title)
             title_specs = self.extract_specs_from_text(clean_title, max_specs=2)
             for key, value in title_specs.items():
                 if key not in all_specs:
                     all_specs[key] = value
         
         # 3. Add brand
-        brand = self.extract_brand(row.get('Title'), row.get('Vendor'))
+        brand = self.extract_brand(title, vendor)
         if brand and 'Brand' not in all_specs:
             all_specs['Brand'] = brand
+            column_keys.add('Brand')
         
         # 4. Add product type
-        if pd.notna(row.get('Type')):
-            product_type = str(row['Type']).strip()
+        if has_value(product_type):
+            product_type = str(product_type).strip()
             if product_type and 3 < len(product_type) < 50:
                 all_specs['Category'] = product_type
+                column_keys.add('Category')
         
         # 5. Add material from metafield if available
-        if pd.notna(row.get('Metafield: custom.product_material [single_line_text_field]')):
-            material = str(row['Metafield: custom.product_material [single_line_text_field]']).strip()
+        if has_value(material):
+            material = str(material).strip()
             if 'Material' not in all_specs and 3 < len(material) < 30:
                 all_specs['Material'] = material
+                column_keys.add('Material')
         
         # 6. Add 1-2 key features only if we have less than 4 specs
-        if len(all_specs) < 4 and pd.notna(row.get('Body HTML')):
-            clean_text = self.clean_html(row['Body HTML'])
+        if len(all_specs) < 4 and clean_text:
             features = self.extract_key_features(clean_text, max_features=min(2, 5 - len(all_specs)))
             for label, feature in features:
                 all_specs[label] = feature
         
-        return self.format_specs_for_shopify(all_specs)
+        return all_specs, len(all_specs) - len(column_keys)
     
     def format_specs_for_shopify(self, specs: Dict[str, str]) -> str:
         """Format specifications as JSON array"""
@@ -244,14 +429,31 @@ class EnhancedSpecExtractor:
             return ""
         
         spec_list = [f"{key}: {value}" for key, value in specs.items()]
-        return json.dumps(spec_list)
+        return json_dumps(spec_list)
+
+
+# Below this many rows, worker start-up costs more than it saves
+MIN_ROWS_FOR_POOL = 200
+
+# One extractor per worker process, built on first use
+_worker_extractor = None
+
+
+def process_row_worker(record: Tuple) -> str:
+    """Process one (title, body, vendor, type, material) record in a worker process"""
+    global _worker_extractor
+    if _worker_extractor is None:
+        _worker_extractor = EnhancedSpecExtractor()
+    return _worker_extractor.process_fields(*record)
 
 
 def process_excel_file(
     input_file: str,
     output_file: str = None,
     overwrite_existing: bool = False,
-    verbose: bool = True
+    verbose: bool = True,
+    workers: Optional[int] = None,
+    fmt: Optional[str] = None
 ):
     """
     Process Excel file and populate specifications
@@ -261,21 +463,22 @@ def process_excel_file(
         output_file: Path to output file (defaults to input_file_with_specs.xlsx)
         overwrite_existing: If True, overwrite existing specs
         verbose: If True, print detailed progress
+        workers: Number of worker processes (defaults to the CPU count;
+            1 disables multiprocessing)
+        fmt: Output format ('xlsx', 'csv' or 'parquet'; defaults to the
+            output file's extension)
     """
     
     if verbose:
         print(f"Reading Excel file: {input_file}")
     
-    df = pd.read_excel(input_file, sheet_name=0)
+    df = read_products(input_file)
     
     if verbose:
         print(f"Found {len(df)} products\n")
     
-    # Initialize extractor
-    extractor = EnhancedSpecExtractor()
-    
     # Column names
-    spec_col = 'Metafield: custom.spec_list [list.single_line_text_field]'
+    spec_col = SPEC_COL
     
     # Track statistics
     stats = {
@@ -286,34 +489,58 @@ def process_excel_file(
         'specs_extracted': 0
     }
     
+    # Pull the source columns out once instead of boxing every row
+    titles = column_values(df, TITLE_COL)
+    bodies = column_values(df, BODY_COL)
+    vendors = column_values(df, VENDOR_COL)
+    types = column_values(df, TYPE_COL)
+    materials = column_values(df, MATERIAL_COL)
+    results = column_values(df, spec_col)
+    
     # Process each row
     if verbose:
         print("Processing products...")
         print("="*70)
     
-    for idx, row in df.iterrows():
+    # Collect rows that need specs
+    pending = []
+    for i in range(len(df)):
         # Check if already has specs
-        has_existing = pd.notna(row[spec_col]) and str(row[spec_col]).strip()
+        existing = results[i]
+        has_existing = has_value(existing) and str(existing).strip()
         
         if has_existing and not overwrite_existing:
             stats['already_populated'] += 1
             continue
         
-        # Extract and format specs
-        specs_json = extractor.process_row(row)
-        
+        pending.append(i)
+    
+    records = [
+        (titles[i], bodies[i], vendors[i], types[i], materials[i])
+        for i in pending
+    ]
+    
+    # Extract and format specs, across processes for larger files
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(records) >= MIN_ROWS_FOR_POOL:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            extracted = list(pool.map(process_row_worker, records, chunksize=64))
+    else:
+        extracted = [process_row_worker(record) for record in records]
+    
+    for i, specs_json in zip(pending, extracted):
         if specs_json:
-            df.at[idx, spec_col] = specs_json
+            results[i] = specs_json
             stats['newly_populated'] += 1
             
             # Count specs
             try:
-                specs_list = json.loads(specs_json)
+                specs_list = json_loads(specs_json)
                 stats['specs_extracted'] += len(specs_list)
                 
                 # Print sample for first few
                 if verbose and stats['newly_populated'] <= 3:
-                    print(f"\n✓ {row.get('Title', 'Unknown')}")
+                    print(f"\n✓ {titles[i] if has_value(titles[i]) else 'Unknown'}")
                     for spec in specs_list:
                         print(f"  • {spec}")
             except:
@@ -321,17 +548,19 @@ def process_excel_file(
         else:
             stats['skipped'] += 1
     
+    df[spec_col] = results
+    
     # Determine output file
     if output_file is None:
         base_name = os.path.splitext(input_file)[0]
-        output_file = f"{base_name}_with_specs.xlsx"
+        output_file = f"{base_name}_with_specs.{fmt or 'xlsx'}"
     
     # Save the updated Excel file
     if verbose:
         print(f"\n{'='*70}")
         print(f"Saving to: {output_file}")
     
-    df.to_excel(output_file, index=False, engine='openpyxl')
+    write_products(df, output_file, fmt)
     
     # Print summary
     if verbose:
@@ -362,6 +591,8 @@ Examples:
   python populate_specs_v2.py test-list.xlsx
   python populate_specs_v2.py test-list.xlsx -o output.xlsx
   python populate_specs_v2.py test-list.xlsx --overwrite
+  python populate_specs_v2.py test-list.xlsx --workers 4
+  python populate_specs_v2.py test-list.xlsx -o output.parquet
         """
     )
     
@@ -371,6 +602,10 @@ Examples:
                        help='Overwrite existing specifications')
     parser.add_argument('-q', '--quiet', action='store_true',
                        help='Suppress progress output')
+    parser.add_argument('-j', '--workers', type=int,
+                       help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS,
+                       help='Output format (default: from output extension, else xlsx)')
     
     args = parser.parse_args()
     
@@ -379,7 +614,9 @@ Examples:
             args.input_file,
             args.output,
             overwrite_existing=args.overwrite,
-            verbose=not args.quiet
+            verbose=not args.quiet,
+            workers=args.workers,
+            fmt=args.format
         )
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)